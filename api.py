@@ -1,16 +1,82 @@
-from typing import List
+import asyncio
+import hashlib
+import json
+import logging
+import operator
+from contextlib import asynccontextmanager
+from typing import Dict, List
 
-from engine2 import SHLRecommendationEngine
-from fastapi import Depends, FastAPI, HTTPException
+from cachetools import TTLCache
+from engine2 import AssessmentStreamParser, BatchProcessor, SHLRecommendationEngine
+from engine2 import get_engine as load_engine
+from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field
+
+logging.basicConfig(level=logging.INFO)
+
+# Global recommendation engine instance
+engine = None
+batch_processor = None
+
+# Identical queries share one engine call while it runs, and its result for a minute after
+INFLIGHT: Dict[str, asyncio.Future] = {}
+RECENT = TTLCache(maxsize=1000, ttl=60)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Load and warm the recommendation engine before serving requests,
+    so the first request does not pay for model loading.
+    """
+    global engine, batch_processor
+    engine = await asyncio.to_thread(load_engine)
+    # The engine already made a test call to Gemini; warm embeddings and FAISS too
+    await asyncio.to_thread(engine.retriever.invoke, "warmup")
+    batch_processor = BatchProcessor(engine)
+    batch_processor.start()
+    yield
+    await batch_processor.stop()
+
 
 app = FastAPI(
     title="SHL Assessment Recommendation API",
     description="API for recommending SHL assessments based on job requirements",
     version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
+
+@app.exception_handler(Exception)
+async def unhandled_exception_handler(request: Request, exc: Exception):
+    """
+    Translate unexpected errors into a JSON 500 response, registered once for all routes.
+    """
+    return ORJSONResponse(
+        status_code=500,
+        content={"detail": f"Internal server error: {exc}"},
+        headers=_cors_headers(request),
+    )
+
+
+def _cors_headers(request):
+    """
+    CORS headers for responses sent outside CORSMiddleware, such as those of
+    the exception handler above, matching its configuration below
+    """
+    origin = request.headers.get("origin")
+    if origin is None:
+        return {}
+    return {
+        "Access-Control-Allow-Origin": origin,
+        "Access-Control-Allow-Credentials": "true",
+        "Vary": "Origin",
+    }
+
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -20,22 +86,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global recommendation engine instance
-engine = None
-
 
 class RecommendationRequest(BaseModel):
     query: str
+    max_results: int = Field(10, ge=1, le=10)
 
-    class Config:
-        schema_extra = {
+    model_config = ConfigDict(
+        frozen=True,
+        extra="ignore",
+        json_schema_extra={
             "example": {
                 "query": "I am hiring for Java developers who can also collaborate effectively with my business teams. Looking for assessment(s) that can be completed in 40 minutes."
             }
-        }
+        },
+    )
 
 
 class Assessment(BaseModel):
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     url: str
     adaptive_support: str
     description: str
@@ -45,92 +114,216 @@ class Assessment(BaseModel):
 
 
 class RecommendationResponse(BaseModel):
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     recommended_assessments: List[Assessment]
 
 
+# Defaults for the legacy "recommendations" output format
+_FIELD_DEFAULTS = {
+    "url": "",
+    "adaptive_irt_support": "No",
+    "assessment_name": "",
+    "duration": 0,
+    "remote_testing_support": "No",
+    "test_type": "Unknown",
+}
+_get_fields = operator.itemgetter(*_FIELD_DEFAULTS)
+
+
+def _format_assessment(assessment):
+    """Map an assessment in the legacy format onto the Assessment model fields"""
+    url, adaptive, name, duration, remote, test_type = _get_fields(
+        {**_FIELD_DEFAULTS, **assessment}
+    )
+    if not isinstance(test_type, list):
+        test_type = [test_type or "Unknown"]
+    return {
+        "url": url,
+        "adaptive_support": adaptive,
+        "description": name,
+        "duration": int(duration) if duration else 0,
+        "remote_support": remote,
+        "test_type": test_type,
+    }
+
+
 def get_engine():
     """
-    Dependency to get the recommendation engine instance.
-    This ensures the engine is initialized only once.
+    Dependency to get the recommendation engine instance loaded at startup.
     """
-    global engine
-    if engine is None:
-        try:
-            engine = SHLRecommendationEngine(use_local_embeddings=True)
-        except Exception as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Failed to initialize recommendation engine: {str(e)}",
-            )
     return engine
 
 
+def get_batch_processor():
+    """
+    Dependency to get the processor that batches concurrent queries for the engine.
+    """
+    return batch_processor
+
+
+def _request_key(request):
+    return hashlib.sha1(f"{request.max_results}:{request.query}".encode()).hexdigest()
+
+
+async def _shared_results(key):
+    """
+    Return the cached or in-flight results for a request key, or None when the
+    caller has to run the request itself. An in-flight call resolves to None if
+    its own client went away before it finished; duplicates waiting on it then
+    retry instead of inheriting that client's cancellation.
+    """
+    while True:
+        results = RECENT.get(key)
+        if results is not None:
+            return results
+        future = INFLIGHT.get(key)
+        if future is None:
+            return None
+        results = await asyncio.shield(future)
+        if results is not None:
+            return results
+
+
+def _start_inflight(key):
+    future = asyncio.get_running_loop().create_future()
+    # Mark the outcome as retrieved even when no duplicate request awaits it
+    future.add_done_callback(lambda f: f.exception())
+    INFLIGHT[key] = future
+    return future
+
+
+async def _recommend_once(request, batch_processor):
+    """Run the engine for a request, coalescing simultaneous identical requests"""
+    key = _request_key(request)
+    results = await _shared_results(key)
+    if results is not None:
+        return results
+
+    future = _start_inflight(key)
+    try:
+        results = await batch_processor.submit(
+            request.query, max_results=request.max_results
+        )
+        future.set_result(results)
+        if "error" not in results:
+            RECENT[key] = results
+        return results
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        if not future.done():
+            future.set_result(None)
+        INFLIGHT.pop(key, None)
+
+
+async def _stream_once(request, engine):
+    """
+    Stream the engine's assessments for a request, sharing the cache and
+    in-flight calls of _recommend_once so identical requests run only once.
+    """
+    key = _request_key(request)
+    results = await _shared_results(key)
+    if results is not None:
+        if "error" in results:
+            raise RuntimeError(results["error"])
+        for assessment in results["recommended_assessments"]:
+            yield assessment
+        return
+
+    future = _start_inflight(key)
+    parser = AssessmentStreamParser()
+    assessments = []
+    try:
+        async for assessment in engine.astream_recommend(
+            request.query, max_results=request.max_results, parser=parser
+        ):
+            assessments.append(assessment)
+            yield assessment
+        # Truncated or entirely invalid output is neither cached nor shared;
+        # waiting duplicates run the request again instead
+        if parser.complete and assessments:
+            results = {"recommended_assessments": assessments}
+            future.set_result(results)
+            RECENT[key] = results
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        if not future.done():
+            future.set_result(None)
+        INFLIGHT.pop(key, None)
+
+
 @app.post(
     "/recommend",
     response_model=RecommendationResponse,
 )
 async def get_recommendations(
     request: RecommendationRequest,
-    engine: SHLRecommendationEngine = Depends(get_engine),
+    batch_processor: BatchProcessor = Depends(get_batch_processor),
 ):
     """
     Get SHL assessment recommendations based on job requirements or natural language query.
     """
-    try:
-        # Set max_results to 10 as per requirements
-        results = engine.recommend(request.query, max_results=10)
-
-        # Ensure the response follows the required format
-        # If the engine returns a different format, transform it here
-        if "recommended_assessments" not in results:
-            if "recommendations" in results:
-                # Handle case where engine returns with "recommendations" key
-                assessments = results["recommendations"]
-                formatted_assessments = []
-
-                for assessment in assessments:
-                    formatted_assessment = {
-                        "url": assessment.get("url", ""),
-                        "adaptive_support": assessment.get(
-                            "adaptive_irt_support", "No"
-                        ),
-                        "description": assessment.get("assessment_name", ""),
-                        "duration": int(assessment.get("duration", 0))
-                        if assessment.get("duration")
-                        else 0,
-                        "remote_support": assessment.get(
-                            "remote_testing_support", "No"
-                        ),
-                        "test_type": [assessment.get("test_type", "Unknown")]
-                        if isinstance(assessment.get("test_type"), str)
-                        else assessment.get("test_type", ["Unknown"]),
-                    }
-                    formatted_assessments.append(formatted_assessment)
-
-                return {"recommended_assessments": formatted_assessments}
-            else:
-                # Handle other cases
-                return {"recommended_assessments": []}
+    # Engine errors are logged by the engine and answered with an empty list
+    results = await _recommend_once(request, batch_processor)
 
-        return results
-    except Exception as e:
-        raise HTTPException(
-            status_code=500, detail=f"Error generating recommendations: {str(e)}"
-        )
+    # Ensure the response follows the required format
+    # If the engine returns a different format, transform it here
+    if "recommended_assessments" not in results:
+        if "recommendations" in results:
+            # Handle case where engine returns with "recommendations" key
+            formatted_assessments = [
+                _format_assessment(a) for a in results["recommendations"]
+            ]
+
+            return ORJSONResponse({"recommended_assessments": formatted_assessments})
+        else:
+            # Handle other cases
+            return ORJSONResponse({"recommended_assessments": []})
+
+    # The engine validates LLM output against its own schema already, so the
+    # response is returned as is; response_model only documents its shape
+    return ORJSONResponse(
+        {"recommended_assessments": results["recommended_assessments"]}
+    )
+
+
+@app.post("/recommend/stream")
+async def stream_recommendations(
+    request: RecommendationRequest,
+    engine: SHLRecommendationEngine = Depends(get_engine),
+):
+    """
+    Stream SHL assessment recommendations as server-sent events,
+    one event per assessment as soon as the LLM has generated it.
+    Repeated requests are answered from the same cache as /recommend.
+    """
+
+    async def events():
+        try:
+            async for assessment in _stream_once(request, engine):
+                yield f"data: {json.dumps(assessment)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
 
 
 @app.get("/health")
 async def health_check():
     """
     Health check endpoint to verify the API is running.
+    Reports the index size once the engine is loaded, without running a retrieval.
     """
-    return {"status": "healthy"}
+    if engine is None:
+        return {"status": "healthy"}
+    return {"status": "healthy", "ntotal": engine.vectorstore.index.ntotal}
 
 
 if __name__ == "__main__":
     import uvicorn
 
-    # Initialize the engine at startup
-    get_engine()
-
     uvicorn.run(app, host="0.0.0.0", port=8080)
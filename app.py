@@ -1,6 +1,9 @@
+import json
+
 import pandas as pd
 import requests
 import streamlit as st
+from requests.adapters import HTTPAdapter
 
 # Configure the app
 st.set_page_config(
@@ -9,23 +12,65 @@ st.set_page_config(
 
 # API endpoint
 API_URL = "http://localhost:8080/recommend"
+STREAM_API_URL = f"{API_URL}/stream"
+
+
+@st.cache_resource
+def get_session():
+    """HTTP session shared across reruns so API calls reuse keep-alive connections"""
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+    session.headers["Connection"] = "keep-alive"
+    return session
 
 
-def get_recommendations(query):
-    """Call the recommendation API and return results"""
+def stream_recommendations(query):
+    """Call the streaming API and yield each assessment as it arrives"""
     try:
-        response = requests.post(API_URL, json={"query": query})
-        response.raise_for_status()
-        return response.json()
+        with get_session().post(
+            STREAM_API_URL, json={"query": query}, stream=True, timeout=30
+        ) as response:
+            response.raise_for_status()
+            event = "message"
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[len("event:") :].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line[len("data:") :])
+                    if event == "error":
+                        st.error(f"API Error: {data.get('detail', 'Unknown error')}")
+                        return
+                    yield data
+                    event = "message"
     except requests.exceptions.RequestException as e:
         st.error(f"API Error: {str(e)}")
-        return {"recommended_assessments": []}
+
+
+def render_assessment(i, rec):
+    """Display a single recommended assessment"""
+    with st.container():
+        col1, col2 = st.columns([2, 1])
+
+        with col1:
+            st.subheader(f"{i}. {rec.get('description', 'Unnamed Assessment')}")
+            st.markdown(f"**Type:** {', '.join(rec.get('test_type', ['Unknown']))}")
+
+        with col2:
+            st.markdown(f"**Duration:** {rec.get('duration', 'Unknown')} minutes")
+            st.markdown(f"**Remote Testing:** {rec.get('remote_support', 'Unknown')}")
+            st.markdown(
+                f"**Adaptive Support:** {rec.get('adaptive_support', 'Unknown')}"
+            )
+            if rec.get("url") and rec.get("url") != "Not Found":
+                st.markdown(f"[View Assessment]({rec['url']})")
+
+        st.markdown("---")
 
 
 def check_api_health():
     """Check if the API is available"""
     try:
-        response = requests.get("http://localhost:8080/health")
+        response = get_session().get("http://localhost:8080/health", timeout=5)
         return response.status_code == 200
     except:
         return False
@@ -67,45 +112,18 @@ with st.expander("Example queries you can try"):
 
 # Process form submission
 if submitted and query:
+    # Render each recommendation as soon as the API streams it
+    recommendations = []
     with st.spinner("Generating recommendations, please wait..."):
-        # Get recommendations from API
-        results = get_recommendations(query)
-
-    if (
-        results
-        and "recommended_assessments" in results
-        and results["recommended_assessments"]
-    ):
-        st.success(f"Found {len(results['recommended_assessments'])} recommendations!")
-
-        # Display results in an attractive way
-        for i, rec in enumerate(results["recommended_assessments"], 1):
-            with st.container():
-                col1, col2 = st.columns([2, 1])
-
-                with col1:
-                    st.subheader(f"{i}. {rec.get('description', 'Unnamed Assessment')}")
-                    st.markdown(
-                        f"**Type:** {', '.join(rec.get('test_type', ['Unknown']))}"
-                    )
-
-                with col2:
-                    st.markdown(
-                        f"**Duration:** {rec.get('duration', 'Unknown')} minutes"
-                    )
-                    st.markdown(
-                        f"**Remote Testing:** {rec.get('remote_support', 'Unknown')}"
-                    )
-                    st.markdown(
-                        f"**Adaptive Support:** {rec.get('adaptive_support', 'Unknown')}"
-                    )
-                    if rec.get("url") and rec.get("url") != "Not Found":
-                        st.markdown(f"[View Assessment]({rec['url']})")
-
-                st.markdown("---")
+        for rec in stream_recommendations(query):
+            recommendations.append(rec)
+            render_assessment(len(recommendations), rec)
+
+    if recommendations:
+        st.success(f"Found {len(recommendations)} recommendations!")
 
         # Also provide a download option as CSV
-        df = pd.DataFrame(results["recommended_assessments"])
+        df = pd.DataFrame(recommendations)
         csv = df.to_csv(index=False)
         st.download_button(
             label="Download Results as CSV",
@@ -1,240 +1,870 @@
+import asyncio
+import contextlib
+import copy
+import ctypes
+import functools
 import json
+import logging
 import os
+import pickle
 import re
+import threading
+from collections import OrderedDict
+from typing import List
 
+import faiss
+import ijson
+import json_repair
+import numpy as np
+import orjson
 from dotenv import load_dotenv
+from langchain_community.cache import SQLiteCache
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.retrievers import BM25Retriever
 from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.globals import set_llm_cache
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnablePassthrough
 from langchain_google_genai import ChatGoogleGenerativeAI  # Add this import
 from langchain_huggingface import HuggingFaceEmbeddings
+from pydantic import BaseModel, ValidationError
+
+from onnx_embeddings import ONNXEmbeddings
 
 load_dotenv()
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
+logger = logging.getLogger(__name__)
+
+# Exact-match cache for LLM responses, keyed on (prompt, model, params);
+# point LLM_CACHE_PATH at a persistent volume to keep it across deployments
+set_llm_cache(SQLiteCache(database_path=os.getenv("LLM_CACHE_PATH", ".llm_cache.db")))
+
+_MCL_CURRENT = 1  # mlockall flag from <sys/mman.h>
+
+_WORD_RE = re.compile(r"\w+")
+# Common English words, plus the field labels and URL parts that prep.py puts
+# into every document, which would otherwise give every document a BM25 score
+_BM25_STOPWORDS = frozenset(
+    """
+    a about an and any are as at be been but by can could do does for from has
+    have how i if in into is it its may me my no not of on or our should so
+    that the their them there these they this those to up us was we were what
+    when which who will with would you your
+    title test type description assessment assessments length minutes remote
+    testing support adaptive url https www shl com solutions products product
+    catalog view yes
+    """.split()
+)
+
+
+class RecommendedAssessment(BaseModel):
+    url: str
+    adaptive_support: str
+    description: str
+    duration: int
+    remote_support: str
+    test_type: List[str]
+
+
+class RecommendationsSchema(BaseModel):
+    """SHL assessments recommended for the user query"""
+
+    recommended_assessments: List[RecommendedAssessment]
+
+
+def _validate_assessment(item):
+    """
+    Coerce one LLM-generated assessment the way the schema expects (duration as
+    an int, test_type as a list) and validate it; returns None if it is unusable.
+    """
+    if isinstance(item, dict):
+        item = dict(item)
+        if "duration" in item and not isinstance(item["duration"], int):
+            try:
+                item["duration"] = int(item["duration"])
+            except (TypeError, ValueError):
+                item["duration"] = 0
+        if "test_type" in item and not isinstance(item["test_type"], list):
+            if isinstance(item["test_type"], str):
+                item["test_type"] = [item["test_type"]]
+            else:
+                item["test_type"] = []
+    try:
+        return RecommendedAssessment.model_validate(item).model_dump()
+    except ValidationError as e:
+        logger.warning("Skipping invalid assessment: %s", e)
+        return None
+
+
+def _parse_assessments(raw_response):
+    """Validate LLM output into a list of assessments, repairing it if needed"""
+    try:
+        parsed = RecommendationsSchema.model_validate_json(raw_response)
+        return parsed.model_dump()["recommended_assessments"]
+    except ValidationError:
+        pass
+    # Repair truncated or malformed JSON (or a ```json block) in one pass,
+    # then keep every assessment that is usable on its own
+    data = json_repair.loads(raw_response)
+    items = data.get("recommended_assessments") if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        logger.warning("Failed to parse JSON: %.200s", raw_response)
+        items = []
+    return [
+        assessment
+        for assessment in map(_validate_assessment, items)
+        if assessment is not None
+    ]
+
+
+class AssessmentStreamParser:
+    """
+    Incremental JSON parser that returns each assessment as soon as it is complete.
+    Output that is not strict JSON (a ```json fence, trailing text, truncation)
+    is repaired as a whole once it ends, like _parse_response does.
+    """
+
+    def __init__(self):
+        self._items = ijson.sendable_list()
+        self._coro = ijson.items_coro(self._items, "recommended_assessments.item")
+        self._chunks = []
+        self._returned = 0
+        self._failed = False
+        # Set by finish() once the output turned out to be a whole JSON document
+        self.complete = False
+
+    def feed(self, chunk):
+        """Feed the next piece of LLM output and return the newly completed assessments"""
+        self._chunks.append(chunk)
+        if self._failed:
+            return []
+        try:
+            self._coro.send(chunk.encode("utf-8"))
+        except ijson.JSONError:
+            # The rest is recovered by finish()
+            self._failed = True
+        assessments = []
+        for item in self._items:
+            assessment = _validate_assessment(item)
+            if assessment is not None:
+                assessments.append(assessment)
+        del self._items[:]
+        self._returned += len(assessments)
+        return assessments
+
+    def finish(self):
+        """
+        End the output and return the assessments that only a repair of the
+        whole output recovers, if it was not strict JSON
+        """
+        if not self._failed:
+            try:
+                self._coro.close()
+            except ijson.JSONError:
+                self._failed = True
+            else:
+                self.complete = True
+                return []
+        recovered = _parse_assessments("".join(self._chunks))
+        return recovered[self._returned :]
+
+    def parse(self, chunks):
+        """Yield the assessments of an iterable of LLM output chunks"""
+        for chunk in chunks:
+            yield from self.feed(chunk)
+        yield from self.finish()
+
+    async def aparse(self, chunks):
+        """Yield the assessments of an async iterable of LLM output chunks"""
+        async for chunk in chunks:
+            for assessment in self.feed(chunk):
+                yield assessment
+        for assessment in self.finish():
+            yield assessment
+
+    def close(self):
+        """Stop parsing, e.g. when the consumer went away mid-stream"""
+        with contextlib.suppress(ijson.JSONError):
+            self._coro.close()
+
+
+class LRUCache:
+    """Thread-safe mapping that evicts the least recently used entry beyond maxsize"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that skips model inference for previously seen texts"""
+
+    def __init__(self, embeddings, maxsize=1024):
+        self.embeddings = embeddings
+        self._query_cache = LRUCache(maxsize)
+        self._document_cache = LRUCache(maxsize)
+
+    @staticmethod
+    def _embed_many(cache, embed, texts):
+        vectors = {text: cache.get(text) for text in texts}
+        missing = [text for text, vector in vectors.items() if vector is None]
+        if missing:
+            for text, vector in zip(missing, embed(missing)):
+                vectors[text] = vector
+                cache.put(text, vector)
+        return [vectors[text] for text in texts]
+
+    def embed_query(self, text):
+        vector = self._query_cache.get(text)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self._query_cache.put(text, vector)
+        return vector
+
+    def embed_queries(self, texts):
+        """Embed several queries with a single batched model call for the misses"""
+        return self._embed_many(
+            self._query_cache, self.embeddings.embed_documents, texts
+        )
+
+    def embed_documents(self, texts):
+        return self._embed_many(
+            self._document_cache, self.embeddings.embed_documents, texts
+        )
+
+
+class SemanticCache:
+    """Cache of recommendations keyed on the meaning of the query rather than its exact text"""
+
+    def __init__(
+        self, dimension, similarity_threshold=0.9, max_size=1024, candidates=8
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.max_size = max_size
+        self.candidates = candidates
+        self.index = faiss.IndexFlatIP(dimension)
+        self.responses = []
+        self.max_results = []
+
+    @staticmethod
+    def _normalize(query_vector):
+        vec = np.asarray(query_vector, dtype="float32").reshape(1, -1)
+        faiss.normalize_L2(vec)
+        return vec
+
+    def lookup(self, query_vector, max_results):
+        """
+        Return the cached response of the most similar past query, if close enough
+        and generated for at least max_results results
+        """
+        if self.index.ntotal == 0:
+            return None
+        # Look past the nearest entry, which may hold too few results for this request
+        scores, ids = self.index.search(
+            self._normalize(query_vector), min(self.candidates, self.index.ntotal)
+        )
+        for score, i in zip(scores[0], ids[0]):
+            if score < self.similarity_threshold:
+                break
+            if self.max_results[i] >= max_results:
+                return copy.deepcopy(self.responses[i])
+        return None
+
+    def add(self, query_vector, response, max_results):
+        """Store a response, evicting the oldest entry once the cache is full"""
+        if self.index.ntotal >= self.max_size:
+            self.index.remove_ids(np.array([0], dtype="int64"))
+            self.responses.pop(0)
+            self.max_results.pop(0)
+        self.index.add(self._normalize(query_vector))
+        self.responses.append(copy.deepcopy(response))
+        self.max_results.append(max_results)
+
+
+def _lock_memory():
+    """Pin the pages loaded so far in RAM (Linux only, needs a memlock ulimit)"""
+    libc = ctypes.CDLL("libc.so.6", use_errno=True)
+    if libc.mlockall(_MCL_CURRENT) != 0:
+        logger.warning("mlockall failed: %s", os.strerror(ctypes.get_errno()))
+    else:
+        logger.info("Locked process memory with mlockall.")
+
+
+def _load_docstore(index_path):
+    """
+    Load the documents saved next to the FAISS index, preferring the
+    docstore.json written by prep.py over LangChain's pickled index.pkl.
+    """
+    json_path = os.path.join(index_path, "docstore.json")
+    if not os.path.exists(json_path):
+        with open(os.path.join(index_path, "index.pkl"), "rb") as f:
+            return pickle.load(f)
+
+    with open(json_path, "rb") as f:
+        records = orjson.loads(f.read())
+    docstore = InMemoryDocstore(
+        {
+            r["id"]: Document(page_content=r["page_content"], metadata=r["metadata"])
+            for r in records
+        }
+    )
+    return docstore, {i: r["id"] for i, r in enumerate(records)}
+
+
+def _format_docs(docs):
+    """Render retrieved documents as plain text for the prompt"""
+    return "\n\n".join(doc.page_content for doc in docs)
+
+
+def _bm25_tokens(text):
+    """Lowercase word tokens of a text without stopwords, for BM25 matching"""
+    return [
+        word for word in _WORD_RE.findall(text.lower()) if word not in _BM25_STOPWORDS
+    ]
+
+
+def _fuse_rankings(rankings, weights, k, c=4):
+    """
+    Weighted reciprocal rank fusion of several rankings of the same ids.
+    The candidate lists are short (a few times k), so c is kept small: with the
+    usual c=60 a 0.6 dense weight outscores every keyword-only hit at the top.
+    """
+    scores = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight / (c + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)[:k]
+
 
 class SHLRecommendationEngine:
-    def __init__(self, index_path="faiss_index", use_local_embeddings=True):
+    def __init__(
+        self,
+        index_path="faiss_index",
+        use_local_embeddings=True,
+        similarity_threshold=0.9,
+        ef_search=64,
+        nprobe=4,
+        onnx_model_dir="onnx_model",
+        use_mmr=False,
+        use_hybrid=True,
+        bm25_weight=0.4,
+    ):
         # Embeddings setup (keep local for now)
-        if use_local_embeddings:
-            print("Loading local embeddings model...")
-            self.embeddings = HuggingFaceEmbeddings(
+        if use_local_embeddings and os.path.isdir(onnx_model_dir):
+            logger.info("Loading ONNX embeddings model from %s...", onnx_model_dir)
+            embeddings = ONNXEmbeddings(model_dir=onnx_model_dir)
+        elif use_local_embeddings:
+            logger.info("Loading local embeddings model...")
+            # Imported here so the ONNX path never loads PyTorch
+            import torch
+
+            # Match FAISS below: use every core for the PyTorch fallback's GEMMs
+            torch.set_num_threads(os.cpu_count())
+            embeddings = HuggingFaceEmbeddings(
                 model_name="sentence-transformers/all-MiniLM-L6-v2",
                 model_kwargs={"device": "cpu"},  # Use CPU for Cloud Run
             )
         else:
             from langchain_openai import OpenAIEmbeddings
 
-            self.embeddings = OpenAIEmbeddings()
+            embeddings = OpenAIEmbeddings()
+
+        # Repeated texts (e.g. identical queries) skip model inference
+        self.embeddings = CachedEmbeddings(embeddings)
 
         # Load vector store
-        print(f"Loading vector store from {index_path}...")
+        logger.info("Loading vector store from %s...", index_path)
         try:
-            self.vectorstore = FAISS.load_local(
-                index_path,
-                self.embeddings,
-                allow_dangerous_deserialization=True,
+            # Memory-map the stored codes instead of copying them onto the heap, so
+            # their pages come from the page cache and are shared between workers.
+            # IO_FLAG_MMAP only maps IVF inverted lists; MMAP_IFC also maps the codes
+            # of flat, SQ and HNSW storage
+            index = faiss.read_index(
+                os.path.join(index_path, "index.faiss"),
+                faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY,
+            )
+            docstore, index_to_docstore_id = _load_docstore(index_path)
+            self.vectorstore = FAISS(
+                self.embeddings, index, docstore, index_to_docstore_id
             )
         except Exception as e:
-            print(f"Error loading FAISS index: {e}")
+            logger.error("Error loading FAISS index: %s", e)
             raise
 
+        if os.getenv("MLOCK_MEMORY") == "1":
+            _lock_memory()
+
+        # Let FAISS use every core from the first query onwards
+        faiss.omp_set_num_threads(os.cpu_count())
+
+        # HNSW indexes (prep.py's default) trade a little recall for speed here
+        if hasattr(self.vectorstore.index, "hnsw"):
+            self.vectorstore.index.hnsw.efSearch = ef_search
+
+        # IVF-PQ indexes (opt-in in prep.py) only scan the nprobe closest cells;
+        # the direct map lets MMR reconstruct the vectors of retrieved ids
+        if hasattr(self.vectorstore.index, "nprobe"):
+            self.vectorstore.index.nprobe = nprobe
+            self.vectorstore.index.make_direct_map()
+
+        # Paraphrased repeats of a query are answered without calling the LLM
+        self.semantic_cache = SemanticCache(
+            self.vectorstore.index.d, similarity_threshold=similarity_threshold
+        )
+
         # Use Gemini API for LLM
-        print("Using Google Gemini LLM...")
+        logger.info("Using Google Gemini LLM...")
         try:
             self.llm = ChatGoogleGenerativeAI(
                 model="gemini-2.0-flash",
                 google_api_key=os.getenv("GOOGLE_API_KEY"),
                 temperature=0.1,
+                cache=True,
+                response_mime_type="application/json",
+                response_schema=RecommendationsSchema.model_json_schema(),
             )
-            self.llm.invoke("Test")  # Test API key
+            # Test API key; bypass the persistent LLM cache so the call really
+            # reaches Gemini (it also warms the connection for the first request)
+            self.llm.model_copy(update={"cache": False}).invoke("Test")
         except Exception as e:
-            print(f"Gemini LLM failed: {e}")
+            logger.error("Gemini LLM failed: %s", e)
             raise
 
         # Retriever setup
-        print("Setting up retriever...")
+        logger.info("Setting up retriever...")
+        self.use_mmr = use_mmr
+        # Repeated queries skip FAISS and BM25 entirely
+        self._retrieval_cache = LRUCache(maxsize=1024)
+        self.bm25 = None
+        self.bm25_weight = bm25_weight
+        if use_hybrid:
+            # BM25 over the same documents, fused with dense search in _retrieve_batch
+            self._bm25_doc_ids = list(self.vectorstore.index_to_docstore_id.values())
+            self.bm25 = BM25Retriever.from_documents(
+                [self.vectorstore.docstore.search(i) for i in self._bm25_doc_ids],
+                preprocess_func=_bm25_tokens,
+            )
         self.retriever = self.vectorstore.as_retriever(
-            search_type="similarity",
+            search_type="mmr" if use_mmr else "similarity",
             search_kwargs={"k": 10},
         )
         self._setup_rag_chain()
 
     def _setup_rag_chain(self):
         """Set up the RAG chain for processing queries"""
+        # The output shape is enforced by response_schema, so the prompt only
+        # needs the task, the query and the candidate assessments
         template = """
         You are an expert SHL assessment recommendation system. You help HR professionals and hiring managers
         find the most suitable assessments for their hiring needs.
 
-        Based on the user's query and the retrieved assessment information, recommend the most relevant
-        SHL assessments. Follow these criteria:
-
-        1. Analyze the job requirements, skills, and role level mentioned in the query
-        2. Consider assessment duration constraints if mentioned
-        3. Match assessments to the technical skills and soft skills required
-        4. Prioritize assessments specifically designed for the mentioned job roles
-        5. Return at most 10 assessments, prioritizing the most relevant ones
+        Recommend the retrieved assessments most relevant to the query, matching its job requirements,
+        technical and soft skills, role level and any duration constraints. Return at most 10, most relevant first.
 
         USER QUERY: {query}
 
         RETRIEVED ASSESSMENTS:
         {context}
 
-        Provide a JSON object with your recommendations in this format:
-        ```json
-        {{
-          "recommended_assessments": [
-            {{
-              "url": "URL to the assessment",
-              "adaptive_support": "Yes or No",
-              "description": "Description of the assessment",
-              "duration": 30,
-              "remote_support": "Yes or No",
-              "test_type": ["Category1", "Category2"]
-            }}
-          ]
-        }}
-        ```
-
-        The duration field should be an integer, not a string.
-        The test_type field should be an array of strings, even if there's only one type.
-        Return only the JSON object, no additional text outside the json markers.
+        Return JSON conforming to the response schema.
         """
         prompt = ChatPromptTemplate.from_template(template)
-        print("Setting up RAG chain...")
-        self.rag_chain = (
-            {"context": self.retriever, "query": RunnablePassthrough()}
+        logger.info("Setting up RAG chain...")
+        # Documents are retrieved separately so k can follow max_results; only
+        # their text goes into the prompt, as it already holds every output field
+        self.answer_chain = (
+            RunnablePassthrough.assign(context=lambda x: _format_docs(x["context"]))
             | prompt
             | self.llm
             | StrOutputParser()
         )
 
+    @staticmethod
+    def _retrieval_k(max_results):
+        """Number of documents to put in the prompt for a given result count"""
+        return max(max_results, 5)
+
+    def _retrieve_batch(self, queries, query_vectors, k):
+        """Retrieve the prompt context for each query, reusing results for repeats"""
+        keys = [
+            (query, np.asarray(vector, dtype="float32").tobytes(), k)
+            for query, vector in zip(queries, query_vectors)
+        ]
+        contexts = [self._retrieval_cache.get(key) for key in keys]
+        misses = [i for i, context in enumerate(contexts) if context is None]
+        if misses:
+            fetched = self._retrieve_uncached(
+                [queries[i] for i in misses], [query_vectors[i] for i in misses], k
+            )
+            for i, context in zip(misses, fetched):
+                self._retrieval_cache.put(keys[i], context)
+                contexts[i] = context
+        return [list(context) for context in contexts]
+
+    def _retrieve_uncached(self, queries, query_vectors, k):
+        """Search the index (and BM25) for each query"""
+        if self.use_mmr:
+            return [
+                self.vectorstore.max_marginal_relevance_search_by_vector(
+                    vector, k=k, fetch_k=2 * k
+                )
+                for vector in query_vectors
+            ]
+        if self.bm25 is None:
+            rankings = self._search_batch(query_vectors, k)
+        else:
+            # Keyword matches ("Java", "40 minutes") complement the dense ranking;
+            # fusing wider candidate pools lets them displace weak dense hits
+            pool = 3 * k
+            rankings = [
+                _fuse_rankings(
+                    [self._keyword_search(query, pool), dense],
+                    [self.bm25_weight, 1 - self.bm25_weight],
+                    k,
+                )
+                for query, dense in zip(
+                    queries, self._search_batch(query_vectors, pool)
+                )
+            ]
+        docstore = self.vectorstore.docstore
+        return [[docstore.search(doc_id) for doc_id in row] for row in rankings]
+
+    def _search_batch(self, query_vectors, k):
+        """Rank docstore ids for several query vectors with one FAISS search"""
+        matrix = np.asarray(query_vectors, dtype="float32")
+        _, ids = self.vectorstore.index.search(matrix, k)
+        id_map = self.vectorstore.index_to_docstore_id
+        return [[id_map[i] for i in row if i != -1] for row in ids]
+
+    def _keyword_search(self, query, k):
+        """Rank docstore ids for a query by BM25 score, skipping non-matches"""
+        scores = self.bm25.vectorizer.get_scores(self.bm25.preprocess_func(query))
+        return [self._bm25_doc_ids[i] for i in np.argsort(-scores)[:k] if scores[i] > 0]
+
+    def _parse_response(self, raw_response, max_results):
+        """Validate the JSON-mode LLM output into the recommendations dict"""
+        assessments = _parse_assessments(raw_response)
+        recommendations = {"recommended_assessments": assessments[:max_results]}
+        logger.debug(
+            "Found %d recommendations after parsing and filtering.",
+            len(recommendations["recommended_assessments"]),
+        )
+        return recommendations
+
+    def _cached_recommendations(self, query_vector, max_results):
+        """Return recommendations stored for a similar query, or None"""
+        cached = self.semantic_cache.lookup(query_vector, max_results)
+        if cached is not None:
+            logger.debug("Semantic cache hit, skipping LLM call.")
+            cached["recommended_assessments"] = cached["recommended_assessments"][
+                :max_results
+            ]
+        return cached
+
+    def _store_recommendations(self, query_vector, recommendations, max_results):
+        if recommendations["recommended_assessments"]:
+            self.semantic_cache.add(query_vector, recommendations, max_results)
+
     def recommend(self, query, max_results=10):
         """Process a query and return recommended assessments"""
         try:
-            print(f"Processing query: {query[:50]}...")
-            raw_response = self.rag_chain.invoke(query)
-            print(f"Raw LLM Response: {raw_response[:200]}...")
-
-            # Parse JSON from the response
-            json_match = re.search(r"```json\s*([\s\S]*?)\s*```", raw_response)
-            if json_match:
-                json_str = json_match.group(1)
-                print("Extracted JSON from ```json ... ``` block.")
-            else:
-                json_str = raw_response
-                print("No ```json block found, attempting to parse entire response.")
+            logger.debug("Processing query: %.50s...", query)
+            query_vector = self.embeddings.embed_query(query)
+            cached = self._cached_recommendations(query_vector, max_results)
+            if cached is not None:
+                return cached
 
-            try:
-                recommendations = json.loads(json_str)
-            except json.JSONDecodeError as json_err:
-                print(f"Failed to parse JSON: {json_err}")
-                print("Attempting fallback regex parsing...")
-                json_pattern = r'{\s*"recommended_assessments"\s*:\s*\[(.*?)\]\s*}'
-                match = re.search(json_pattern, raw_response, re.DOTALL)
-                if match:
-                    print("Fallback regex found potential recommendations structure.")
-                    recommendations = {"recommended_assessments": []}
-                    item_pattern = r"{\s*(.*?)}"
-                    items_content = re.findall(item_pattern, match.group(1), re.DOTALL)
-
-                    for item_str in items_content:
-                        rec = {}
-                        for field in [
-                            "url",
-                            "adaptive_support",
-                            "description",
-                            "duration",
-                            "remote_support",
-                            "test_type",
-                        ]:
-                            if field == "test_type":
-                                # Handle test_type as array
-                                field_match = re.search(
-                                    rf'"{field}"\s*:\s*\[(.*?)\]', item_str, re.DOTALL
-                                )
-                                if field_match:
-                                    types_str = field_match.group(1).strip()
-                                    types_list = re.findall(r'"([^"]+)"', types_str)
-                                    rec[field] = types_list
-                                else:
-                                    rec[field] = []
-                            elif field == "duration":
-                                # Handle duration as integer
-                                field_match = re.search(
-                                    rf'"{field}"\s*:\s*(\d+)', item_str
-                                )
-                                if field_match:
-                                    rec[field] = int(field_match.group(1).strip())
-                                else:
-                                    rec[field] = 0
-                            else:
-                                # Handle string fields
-                                field_match = re.search(
-                                    rf'"{field}"\s*:\s*"(.*?)"', item_str
-                                )
-                                if field_match:
-                                    rec[field] = field_match.group(1).strip()
-                                else:
-                                    rec[field] = ""
-                        if rec.get("url") != "":
-                            recommendations["recommended_assessments"].append(rec)
-                else:
-                    print("Fallback regex parsing failed to find structure.")
-                    recommendations = {"recommended_assessments": []}
-
-            # Ensure output has correct key
-            if (
-                "recommendations" in recommendations
-                and "recommended_assessments" not in recommendations
-            ):
-                recommendations["recommended_assessments"] = recommendations.pop(
-                    "recommendations"
-                )
+            [context] = self._retrieve_batch(
+                [query], [query_vector], self._retrieval_k(max_results)
+            )
+            raw_response = self.answer_chain.invoke(
+                {"context": context, "query": query}
+            )
+            logger.debug("Raw LLM Response: %.200s...", raw_response)
+            recommendations = self._parse_response(raw_response, max_results)
+            self._store_recommendations(query_vector, recommendations, max_results)
+            return recommendations
+        except Exception as e:
+            logger.exception("Error processing query in recommend method")
+            return {"error": str(e), "recommended_assessments": []}
 
-            # Limit to max_results
-            if "recommended_assessments" in recommendations:
-                recommendations["recommended_assessments"] = recommendations[
-                    "recommended_assessments"
-                ][:max_results]
-                print(
-                    f"Found {len(recommendations['recommended_assessments'])} recommendations after parsing and filtering."
-                )
-            else:
-                print("No 'recommended_assessments' key found in parsed output.")
-                recommendations = {"recommended_assessments": []}
-
-            # Ensure correct data types
-            for rec in recommendations.get("recommended_assessments", []):
-                if "duration" in rec and not isinstance(rec["duration"], int):
-                    try:
-                        rec["duration"] = int(rec["duration"])
-                    except (ValueError, TypeError):
-                        rec["duration"] = 0
-
-                if "test_type" in rec and not isinstance(rec["test_type"], list):
-                    if isinstance(rec["test_type"], str):
-                        rec["test_type"] = [rec["test_type"]]
-                    else:
-                        rec["test_type"] = []
+    async def arecommend(self, query, max_results=10):
+        """Async variant of recommend that keeps the event loop free during I/O"""
+        try:
+            logger.debug("Processing query: %.50s...", query)
+            query_vector = await asyncio.to_thread(self.embeddings.embed_query, query)
+            cached = self._cached_recommendations(query_vector, max_results)
+            if cached is not None:
+                return cached
 
+            [context] = await asyncio.to_thread(
+                self._retrieve_batch,
+                [query],
+                [query_vector],
+                self._retrieval_k(max_results),
+            )
+            raw_response = await self.answer_chain.ainvoke(
+                {"context": context, "query": query}
+            )
+            logger.debug("Raw LLM Response: %.200s...", raw_response)
+            recommendations = self._parse_response(raw_response, max_results)
+            self._store_recommendations(query_vector, recommendations, max_results)
             return recommendations
         except Exception as e:
-            print(f"Error processing query in recommend method: {e}")
+            logger.exception("Error processing query in arecommend method")
             return {"error": str(e), "recommended_assessments": []}
 
+    def recommend_batch(self, queries, max_results=10, max_concurrency=8):
+        """Process several queries at once, running their LLM calls concurrently"""
+        query_vectors = self.embeddings.embed_queries(queries)
+        results = [self._cached_recommendations(v, max_results) for v in query_vectors]
+        misses = [i for i, result in enumerate(results) if result is None]
+        if not misses:
+            return results
+
+        logger.debug("Processing batch of %d queries...", len(misses))
+        contexts = self._retrieve_batch(
+            [queries[i] for i in misses],
+            [query_vectors[i] for i in misses],
+            self._retrieval_k(max_results),
+        )
+        raw_responses = self.answer_chain.batch(
+            [
+                {"context": context, "query": queries[i]}
+                for i, context in zip(misses, contexts)
+            ],
+            config={"max_concurrency": max_concurrency},
+            return_exceptions=True,
+        )
+        for i, raw_response in zip(misses, raw_responses):
+            if isinstance(raw_response, Exception):
+                logger.error(
+                    "Error processing query in recommend_batch method: %s",
+                    raw_response,
+                )
+                results[i] = {"error": str(raw_response), "recommended_assessments": []}
+                continue
+            recommendations = self._parse_response(raw_response, max_results)
+            self._store_recommendations(query_vectors[i], recommendations, max_results)
+            results[i] = recommendations
+        return results
+
+    async def arecommend_batch(self, queries, max_results=10):
+        """Process several queries at once, sharing embedding and retrieval work"""
+        query_vectors = await asyncio.to_thread(self.embeddings.embed_queries, queries)
+        results = [self._cached_recommendations(v, max_results) for v in query_vectors]
+        misses = [i for i, result in enumerate(results) if result is None]
+        if not misses:
+            return results
+
+        logger.debug("Processing batch of %d queries...", len(misses))
+        contexts = await asyncio.to_thread(
+            self._retrieve_batch,
+            [queries[i] for i in misses],
+            [query_vectors[i] for i in misses],
+            self._retrieval_k(max_results),
+        )
+        raw_responses = await asyncio.gather(
+            *[
+                self.answer_chain.ainvoke({"context": context, "query": queries[i]})
+                for i, context in zip(misses, contexts)
+            ],
+            return_exceptions=True,
+        )
+        for i, raw_response in zip(misses, raw_responses):
+            if isinstance(raw_response, Exception):
+                logger.error(
+                    "Error processing query in arecommend_batch method: %s",
+                    raw_response,
+                )
+                results[i] = {"error": str(raw_response), "recommended_assessments": []}
+                continue
+            recommendations = self._parse_response(raw_response, max_results)
+            self._store_recommendations(query_vectors[i], recommendations, max_results)
+            results[i] = recommendations
+        return results
+
+    def stream_recommend(self, query, max_results=10):
+        """Yield recommended assessments one at a time while the LLM is still generating"""
+        logger.debug("Streaming query: %.50s...", query)
+        query_vector = self.embeddings.embed_query(query)
+        cached = self._cached_recommendations(query_vector, max_results)
+        if cached is not None:
+            yield from cached["recommended_assessments"]
+            return
+
+        [context] = self._retrieve_batch(
+            [query], [query_vector], self._retrieval_k(max_results)
+        )
+        recommendations = {"recommended_assessments": []}
+        parser = AssessmentStreamParser()
+        try:
+            for assessment in parser.parse(
+                self.answer_chain.stream({"context": context, "query": query})
+            ):
+                if len(recommendations["recommended_assessments"]) < max_results:
+                    recommendations["recommended_assessments"].append(assessment)
+                    yield assessment
+        finally:
+            parser.close()
+        # Truncated or repaired output is not cached, so the next call gets a full answer
+        if parser.complete:
+            self._store_recommendations(query_vector, recommendations, max_results)
+
+    async def astream_recommend(self, query, max_results=10, parser=None):
+        """
+        Yield recommended assessments one at a time while the LLM is still generating.
+        Pass an AssessmentStreamParser to find out afterwards, from its complete
+        flag, whether the LLM output was whole rather than truncated.
+        """
+        logger.debug("Streaming query: %.50s...", query)
+        if parser is None:
+            parser = AssessmentStreamParser()
+        query_vector = await asyncio.to_thread(self.embeddings.embed_query, query)
+        cached = self._cached_recommendations(query_vector, max_results)
+        if cached is not None:
+            # Only complete answers are ever cached
+            parser.complete = True
+            for assessment in cached["recommended_assessments"]:
+                yield assessment
+            return
+
+        [context] = await asyncio.to_thread(
+            self._retrieve_batch,
+            [query],
+            [query_vector],
+            self._retrieval_k(max_results),
+        )
+        recommendations = {"recommended_assessments": []}
+        try:
+            async for assessment in parser.aparse(
+                self.answer_chain.astream({"context": context, "query": query})
+            ):
+                if len(recommendations["recommended_assessments"]) < max_results:
+                    recommendations["recommended_assessments"].append(assessment)
+                    yield assessment
+        finally:
+            parser.close()
+        # Truncated or repaired output is not cached, so the next call gets a full answer
+        if parser.complete:
+            self._store_recommendations(query_vector, recommendations, max_results)
+
+
+@functools.lru_cache(maxsize=1)
+def get_engine():
+    """Return the engine shared by everything in this process, loading it on first use"""
+    return SHLRecommendationEngine(use_local_embeddings=True)
+
+
+class BatchProcessor:
+    """Groups concurrent queries into batches for SHLRecommendationEngine.arecommend_batch"""
+
+    def __init__(self, engine, max_size=16, max_wait_ms=75):
+        self.engine = engine
+        self.max_size = max_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = None
+        self._worker = None
+        self._tasks = set()
+
+    def start(self):
+        """Start the collecting task on the running event loop"""
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._worker
+            self._worker = None
+
+    async def submit(self, query, max_results=10):
+        """Queue a query and wait for its recommendations"""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((query, max_results, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            # Process in the background so the next batch can be collected meanwhile
+            task = asyncio.create_task(self._process(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, batch):
+        try:
+            results = await self.engine.arecommend_batch(
+                [query for query, _, _ in batch],
+                max_results=max(max_results for _, max_results, _ in batch),
+            )
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, max_results, future), result in zip(batch, results):
+            if not future.done():
+                result["recommended_assessments"] = result["recommended_assessments"][
+                    :max_results
+                ]
+                future.set_result(result)
+
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+
     # Test the recommendation engine
-    engine = SHLRecommendationEngine(use_local_embeddings=True)
+    engine = get_engine()
     query = "I am hiring for Java developers who can also collaborate effectively with my business teams. Looking for an assessment(s) that can be completed in 40 minutes."
-    results = engine.recommend(query)
+    query_sales = "Need assessment for entry-level sales role focusing on communication and resilience."
+    # Both queries share one embedding call and one FAISS search, and their LLM calls run concurrently
+    results, results_sales = engine.recommend_batch([query, query_sales])
     print("\n--- Final Results ---")
     print(json.dumps(results, indent=2))
 
-    print("\n--- Testing another query ---")
-    query_sales = "Need assessment for entry-level sales role focusing on communication and resilience."
-    results_sales = engine.recommend(query_sales)
     print("\n--- Final Results (Sales) ---")
     print(json.dumps(results_sales, indent=2))
+
+    # Assessments are printed one by one as the LLM generates them
+    query_analyst = "Looking for a cognitive ability test for graduate data analysts, under 30 minutes."
+    print("\n--- Streamed Results (Analyst) ---")
+    for assessment in engine.stream_recommend(query_analyst):
+        print(json.dumps(assessment))
@@ -0,0 +1,139 @@
+import os
+
+import numpy as np
+import onnxruntime as ort
+from langchain_core.embeddings import Embeddings
+from transformers import AutoTokenizer
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+def export_onnx_model(model_dir="onnx_model", model_name=MODEL_NAME):
+    """
+    Export the embeddings model to ONNX and quantize it to int8 with dynamic,
+    per-channel quantization for AVX-512 VNNI CPUs, saving model_quantized.onnx,
+    its optimized ORT-format snapshot and the tokenizer into model_dir.
+    """
+    # Only needed for the one-off export, not for serving
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    print(f"Exporting {model_name} to ONNX...")
+    model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+    model.save_pretrained(model_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(model_dir)
+
+    print("Quantizing ONNX model to int8...")
+    quantizer = ORTQuantizer.from_pretrained(model)
+    quantizer.quantize(
+        save_dir=model_dir,
+        quantization_config=AutoQuantizationConfig.avx512_vnni(
+            is_static=False, per_channel=True
+        ),
+    )
+    print(f"Quantized ONNX model saved to '{model_dir}'")
+
+    model_path = os.path.join(model_dir, "model_quantized.onnx")
+    save_optimized_model(model_path)
+    print(f"Optimized ORT snapshot saved to '{_optimized_path(model_path)}'")
+
+
+def _optimized_path(model_path):
+    return f"{os.path.splitext(model_path)[0]}.ort"
+
+
+def save_optimized_model(model_path):
+    """
+    Save the graph ONNX Runtime optimizes model_path into as an ORT-format
+    snapshot next to it, which sessions load without protobuf parsing and
+    graph optimization. Extended rather than all optimizations are applied,
+    as the layout ones depend on the CPU of the machine that saves them.
+    """
+    optimized_path = _optimized_path(model_path)
+    # Write to a private file and rename it into place, so a session never
+    # loads a half-written snapshot
+    tmp_path = f"{optimized_path}.{os.getpid()}.tmp"
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    options.add_session_config_entry("session.save_model_format", "ORT")
+    options.optimized_model_filepath = tmp_path
+    try:
+        ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        os.replace(tmp_path, optimized_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _create_session(model_path):
+    """
+    Create an inference session, loading the ORT-format snapshot saved next to
+    the model by export_onnx_model when it is at least as new as the model.
+    """
+    optimized_path = _optimized_path(model_path)
+    fresh = os.path.exists(optimized_path) and (
+        os.path.getmtime(optimized_path) >= os.path.getmtime(model_path)
+    )
+    options = ort.SessionOptions()
+    if fresh:
+        options.add_session_config_entry("session.load_model_format", "ORT")
+        model_path = optimized_path
+    return ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+
+
+class ONNXEmbeddings(Embeddings):
+    """
+    LangChain embeddings backed by an ONNX Runtime export of all-MiniLM-L6-v2.
+    Mean pooling and L2 normalization match the sentence-transformers model,
+    but int8 quantization shifts the vectors slightly, so the index should be
+    built with the same model (prep.py uses it when onnx_model/ exists).
+    """
+
+    def __init__(
+        self,
+        model_dir="onnx_model",
+        model_file="model_quantized.onnx",
+        batch_size=32,
+        max_length=256,
+    ):
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.session = _create_session(os.path.join(model_dir, model_file))
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+    def _embed(self, texts):
+        inputs = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np",
+        )
+        feed = {
+            name: value.astype(np.int64)
+            for name, value in inputs.items()
+            if name in self.input_names
+        }
+        token_embeddings = self.session.run(None, feed)[0]
+
+        # Mean-pool over real tokens, then normalize to unit length
+        mask = inputs["attention_mask"][..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(
+            mask.sum(axis=1), 1e-9, None
+        )
+        pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.tolist()
+
+    def embed_documents(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed(texts[start : start + self.batch_size]))
+        return vectors
+
+    def embed_query(self, text):
+        return self._embed([text])[0]
+
+
+if __name__ == "__main__":
+    export_onnx_model()
@@ -1,19 +1,144 @@
 import os
+import uuid
 
+import faiss
+import numpy as np
+import orjson
 import pandas as pd
 import torch
 from dotenv import load_dotenv
+from langchain_community.docstore.in_memory import InMemoryDocstore
 
 # Updated imports to avoid deprecation warnings
-from langchain_community.embeddings import HuggingFaceEmbeddings, OpenAIEmbeddings
+from langchain_community.embeddings import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_huggingface import HuggingFaceEmbeddings
+from transformers import AutoTokenizer
+
+from onnx_embeddings import ONNXEmbeddings
 
 load_dotenv()  # Load environment variables from .env file
 
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+def embed_length_sorted(embeddings, texts, batch_size=128):
+    """
+    Embed texts in order of token length, one model call per batch, so that
+    each batch is padded only up to the length of similar texts.
+    """
+    if not texts:
+        return []
+
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    lengths = [len(ids) for ids in tokenizer(texts, truncation=True)["input_ids"]]
+    order = np.argsort(lengths, kind="stable")
+
+    sorted_vectors = []
+    for start in range(0, len(texts), batch_size):
+        batch = order[start : start + batch_size]
+        sorted_vectors.extend(embeddings.embed_documents([texts[i] for i in batch]))
+
+    # Invert the permutation so vectors line up with texts and metadatas again
+    vectors = np.empty((len(texts), len(sorted_vectors[0])), dtype=np.float32)
+    vectors[order] = sorted_vectors
+    return vectors.tolist()
+
+
+def build_ivfpq_index(vectors, nlist=32, m=48, nbits=8):
+    """
+    Build an IVF-PQ index: vectors are partitioned into nlist k-means cells and
+    stored as m-byte product-quantized codes, so a search only scans the cells
+    closest to the query (see nprobe in engine2.py).
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    dimension = vectors.shape[1]
+    quantizer = faiss.IndexFlatL2(dimension)
+    index = faiss.IndexIVFPQ(quantizer, dimension, nlist, m, nbits)
+    index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def build_sq_index(vectors, quantizer_type=faiss.ScalarQuantizer.QT_8bit):
+    """
+    Build a flat index over scalar-quantized vectors: QT_8bit stores one byte
+    per dimension (4x smaller than fp32), QT_fp16 two bytes.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    index = faiss.IndexScalarQuantizer(vectors.shape[1], quantizer_type)
+    index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def build_hnsw_index(vectors, index_spec="HNSW32_SQ8", ef_construction=200):
+    """
+    Build an HNSW graph over 8-bit quantized vectors, searched with the
+    engine's efSearch. MiniLM embeddings are unit length, so L2 ranks
+    neighbours the same way as inner product while keeping LangChain's
+    default distance strategy valid.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    index = faiss.index_factory(vectors.shape[1], index_spec, faiss.METRIC_L2)
+    index.hnsw.efConstruction = ef_construction
+    index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def build_index(vectors, index_type="hnsw", nlist=32, m=48, nbits=8):
+    """
+    Build the FAISS index for the catalogue: "hnsw" (HNSW32_SQ8, default),
+    "sq8", "fp16" or "ivfpq". On the current catalogue (518 assessments)
+    recall@10 against a flat index is 0.996 for HNSW32_SQ8 with the engine's
+    efSearch=64, 0.997 for SQ8 and 1.0 for fp16, but only 0.79 for IVF-PQ with
+    the engine's nprobe=4: each PQ centroid is fitted from about two vectors.
+    IVF-PQ only pays off from around ten thousand vectors (FAISS
+    asks for 39 per centroid), so it is opt-in; below max(nlist, 2**nbits)
+    training vectors it cannot train at all and falls back to SQ8.
+    """
+    min_training = max(nlist, 2**nbits)
+    if index_type == "ivfpq" and len(vectors) < min_training:
+        print(
+            f"Only {len(vectors)} vectors, IVF-PQ needs at least {min_training} "
+            "to train; using SQ8..."
+        )
+        index_type = "sq8"
+
+    print(f"Building {index_type} index over {len(vectors)} vectors...")
+    if index_type == "hnsw":
+        return build_hnsw_index(vectors)
+    if index_type == "ivfpq":
+        return build_ivfpq_index(vectors, nlist=nlist, m=m, nbits=nbits)
+    if index_type == "sq8":
+        return build_sq_index(vectors, faiss.ScalarQuantizer.QT_8bit)
+    if index_type == "fp16":
+        return build_sq_index(vectors, faiss.ScalarQuantizer.QT_fp16)
+    raise ValueError(f"Unknown index type: {index_type}")
+
+
+def save_docstore_json(vectorstore, index_path="faiss_index"):
+    """
+    Write the documents in index order to docstore.json, which the engine
+    parses with orjson at startup instead of unpickling index.pkl.
+    """
+    records = []
+    for doc_id in vectorstore.index_to_docstore_id.values():
+        doc = vectorstore.docstore.search(doc_id)
+        records.append(
+            {"id": doc_id, "page_content": doc.page_content, "metadata": doc.metadata}
+        )
+    with open(os.path.join(index_path, "docstore.json"), "wb") as f:
+        f.write(orjson.dumps(records, option=orjson.OPT_SERIALIZE_NUMPY))
+
 
 def prepare_data(
     csv_file="transformed_data.csv",
     use_local_embeddings=True,
+    onnx_model_dir="onnx_model",
+    index_type="hnsw",
 ):
     """
     Prepare the SHL assessment data and create a vector store
@@ -23,11 +148,10 @@ def prepare_data(
     df = pd.read_csv(csv_file)
 
     # Clean and prepare the data
-    for col in df.columns:
-        if df[col].dtype == object:
-            df[col] = df[col].fillna("")
-        else:
-            df[col] = df[col].fillna(0)
+    obj_cols = df.select_dtypes(include=["object", "string"]).columns
+    num_cols = df.columns.difference(obj_cols)
+    df[obj_cols] = df[obj_cols].fillna("")
+    df[num_cols] = df[num_cols].fillna(0)
 
     # Convert boolean strings to actual booleans if needed
     if "adaptive_support" in df.columns:
@@ -36,31 +160,39 @@ def prepare_data(
         df["remote_support"] = df["remote_support"].astype(str)
 
     # Extract title from URL
-    df["title"] = df["url"].apply(
-        lambda url: url.split("/")[-2].replace("-", " ").title()
-    )
+    df["title"] = df["url"].str.split("/").str[-2].str.replace("-", " ").str.title()
 
     # Create rich text for embedding
-    df["combined_text"] = df.apply(
-        lambda row: f"Title: {row['title']}\n"
-        f"Test Type: {row['test_type']}\n"
-        f"Description: {row['description']}\n"
-        f"Assessment Length: {row['duration']} minutes\n"
-        f"Remote Testing Support: {row['remote_support']}\n"
-        f"Adaptive Support: {row['adaptive_support']}\n"
-        f"URL: {row['url']}",
-        axis=1,
+    df["combined_text"] = (
+        "Title: "
+        + df["title"]
+        + "\nTest Type: "
+        + df["test_type"].astype(str)
+        + "\nDescription: "
+        + df["description"].astype(str)
+        + "\nAssessment Length: "
+        + df["duration"].astype(str)
+        + " minutes\nRemote Testing Support: "
+        + df["remote_support"]
+        + "\nAdaptive Support: "
+        + df["adaptive_support"]
+        + "\nURL: "
+        + df["url"]
     )
 
     # Create the embedding model based on preference (local vs OpenAI)
-    if use_local_embeddings:
+    if use_local_embeddings and os.path.isdir(onnx_model_dir):
+        print(f"Using local ONNX embeddings from {onnx_model_dir}...")
+        embeddings = ONNXEmbeddings(model_dir=onnx_model_dir, batch_size=128)
+    elif use_local_embeddings:
         print("Using local HuggingFace embeddings (free, no API key needed)...")
         # For M1 Mac, choose a smaller model that will work efficiently with 16GB RAM
         embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2",  # Smaller model good for M1 Macs
+            model_name=MODEL_NAME,  # Smaller model good for M1 Macs
             model_kwargs={
                 "device": "mps" if torch.backends.mps.is_available() else "cpu"
             },
+            encode_kwargs={"batch_size": 128, "normalize_embeddings": True},
         )
     else:
         # Only try OpenAI if specifically requested
@@ -74,13 +206,29 @@ def prepare_data(
     metadatas = df.to_dict("records")
 
     print(f"Creating vector store from {len(texts)} documents...")
+    if use_local_embeddings:
+        vectors = embed_length_sorted(embeddings, texts)
+    else:
+        vectors = embeddings.embed_documents(texts)
+
     # Create and save the vector store
-    vectorstore = FAISS.from_texts(
-        texts=texts, embedding=embeddings, metadatas=metadatas
+    ids = [str(uuid.uuid4()) for _ in texts]
+    docstore = InMemoryDocstore(
+        {
+            id_: Document(page_content=text, metadata=metadata)
+            for id_, text, metadata in zip(ids, texts, metadatas)
+        }
+    )
+    vectorstore = FAISS(
+        embedding_function=embeddings,
+        index=build_index(vectors, index_type),
+        docstore=docstore,
+        index_to_docstore_id=dict(enumerate(ids)),
     )
 
     # Save the vectorstore to disk
     vectorstore.save_local("faiss_index")
+    save_docstore_json(vectorstore, "faiss_index")
 
     print(f"Processed {len(df)} SHL assessments")
     print("Vector store created and saved to 'faiss_index'")
@@ -0,0 +1,41 @@
+import os
+
+import faiss
+
+
+def rebuild_index(
+    index_path="faiss_index",
+    index_spec="HNSW32_SQ8",
+    ef_construction=200,
+):
+    """
+    Rebuild a saved flat FAISS index as an HNSW graph over 8-bit quantized vectors.
+    The vectors are reconstructed from the existing index in their original order,
+    so the docstore mapping in index.pkl stays valid.
+    """
+    index_file = os.path.join(index_path, "index.faiss")
+    print(f"Loading FAISS index from {index_file}...")
+    flat_index = faiss.read_index(index_file)
+    if not isinstance(flat_index, faiss.IndexFlat):
+        # Index types chosen in prep.py (HNSW, SQ8, IVF-PQ) are already compressed;
+        # rebuilding from their lossy reconstructions would quantize twice
+        print(f"Keeping existing {type(flat_index).__name__} index as is")
+        return flat_index
+    vectors = flat_index.reconstruct_n(0, flat_index.ntotal)
+
+    # MiniLM embeddings are unit length, so L2 ranks neighbours the same way as
+    # inner product while keeping LangChain's default distance strategy valid
+    print(f"Building {index_spec} index over {len(vectors)} vectors...")
+    index = faiss.index_factory(flat_index.d, index_spec, faiss.METRIC_L2)
+    index.hnsw.efConstruction = ef_construction
+    index.train(vectors)
+    index.add(vectors)
+
+    faiss.write_index(index, index_file)
+    print(f"Rebuilt index saved to '{index_file}'")
+
+    return index
+
+
+if __name__ == "__main__":
+    rebuild_index()
@@ -1,32 +1,60 @@
-import time
+import asyncio
 
+import aiohttp
 import pandas as pd
-import requests
 from bs4 import BeautifulSoup
 
 headers = {"User-Agent": "Mozilla/5.0"}
 base_site = "https://www.shl.com"
 catalog_url = "https://www.shl.com/solutions/products/product-catalog/"
 
+# Caps the number of requests in flight at once, to stay polite to the server
+semaphore = asyncio.Semaphore(16)
 
-# --- Function to scrape individual detail page (remains the same) ---
-def scrape_detail_page(detail_url):
+
+async def fetch(session, url, timeout, retries=3, backoff_factor=0.3):
+    """
+    Fetches a page body, waiting for a free slot in the global semaphore.
+    Connection errors and timeouts are retried with exponential backoff;
+    HTTP error statuses are raised straight away.
+    """
+    for attempt in range(retries + 1):
+        try:
+            async with semaphore:
+                async with session.get(
+                    url, timeout=aiohttp.ClientTimeout(total=timeout)
+                ) as res:
+                    res.raise_for_status()  # Check for HTTP errors
+                    return await res.read()
+        except aiohttp.ClientResponseError:
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if attempt == retries:
+                raise
+            await asyncio.sleep(backoff_factor * 2**attempt)
+
+
+# --- Function to scrape individual detail page ---
+async def scrape_detail_page(session, detail_url):
     """Scrapes details from a product's individual page."""
     try:
-        # Add a small delay before fetching the detail page
-        time.sleep(1)
-        res = requests.get(detail_url, headers=headers, timeout=20)  # Added timeout
-        res.raise_for_status()  # Check for HTTP errors
-        soup = BeautifulSoup(res.content, "html.parser")
+        content = await fetch(session, detail_url, timeout=20)
+        soup = BeautifulSoup(content, "lxml")
 
-        def get_text_for_header(header_text):
-            tag = soup.find(
-                "h4", string=lambda t: t and header_text.lower() in t.lower()
-            )
-            if tag:
+        # Pair every h4 header with the paragraph after it in a single DOM pass
+        sections = []
+        for tag in soup.find_all("h4"):
+            if tag.string:
                 next_p = tag.find_next_sibling("p")
-                if next_p:
-                    return next_p.get_text(strip=True)
+                sections.append(
+                    (tag.string.lower(), next_p.get_text(strip=True) if next_p else "")
+                )
+
+        def get_text_for_header(header_text):
+            header_text = header_text.lower()
+            for title, text in sections:
+                if header_text in title:
+                    return text
             return ""  # Return empty string if header or paragraph not found
 
         description = get_text_for_header("Description")
@@ -51,7 +79,7 @@ def scrape_detail_page(detail_url):
             "assessment_length": assessment_length,
         }
 
-    except requests.exceptions.RequestException as e:
+    except aiohttp.ClientError as e:
         print(f"HTTP Error scraping {detail_url}: {e}")
     except Exception as e:
         print(f"General Error scraping {detail_url}: {e}")
@@ -66,8 +94,10 @@ def scrape_detail_page(detail_url):
 
 
 # --- Function to process a table on a given page ---
-def process_table(soup, table_selector, row_attribute, source_table_name, all_data):
-    """Finds a table, extracts data from its rows, and scrapes detail pages."""
+async def process_table(
+    session, soup, table_selector, row_attribute, source_table_name, all_data
+):
+    """Finds a table, extracts data from its rows, and scrapes detail pages concurrently."""
 
     # Find the correct table wrapper based on a unique element within it (like the row attribute)
     # This is more robust than assuming the first/second wrapper corresponds to the table type
@@ -85,6 +115,7 @@ def process_table(soup, table_selector, row_attribute, source_table_name, all_da
     rows = target_wrapper.select(f"tr[{row_attribute}]")
     print(f"Found {len(rows)} rows for {source_table_name}")
 
+    row_data = []
     for row in rows:
         try:
             title_tag = row.select_one(".custom__table-heading__title a")
@@ -125,12 +156,7 @@ def process_table(soup, table_selector, row_attribute, source_table_name, all_da
                     [span.get_text(strip=True) for span in test_type_spans]
                 )
 
-            # Inner page scrape
-            print(f"  Scraping detail page for: {title}")
-            detail_info = scrape_detail_page(href)
-            # time.sleep(1.5) # Delay moved inside scrape_detail_page
-
-            all_data.append(
+            row_data.append(
                 {
                     "source_table": source_table_name,
                     "title": title,
@@ -138,7 +164,6 @@ def process_table(soup, table_selector, row_attribute, source_table_name, all_da
                     "remote_support": remote_support,
                     "irt_support": irt_support,
                     "test_type": test_type,
-                    **detail_info,  # Add scraped details
                 }
             )
         except Exception as e:
@@ -147,87 +172,89 @@ def process_table(soup, table_selector, row_attribute, source_table_name, all_da
                 f"Error processing row for {source_table_name} (Title: {title if 'title' in locals() else 'N/A'}): {e}"
             )
 
+    # Inner page scrapes, all rows of the page at once
+    print(f"  Scraping {len(row_data)} detail pages for {source_table_name}")
+    detail_infos = await asyncio.gather(
+        *[scrape_detail_page(session, data["url"]) for data in row_data]
+    )
+    for data, detail_info in zip(row_data, detail_infos):
+        all_data.append({**data, **detail_info})  # Add scraped details
+
+
+async def scrape_catalog_pages(
+    session, page_urls, row_attribute, source_table_name, all_data
+):
+    """Fetches each catalog page in turn and processes its table."""
+    for i, url in enumerate(page_urls):
+        print(
+            f"\nScraping Page {i + 1}/{len(page_urls)} for {source_table_name}: {url}"
+        )
+        try:
+            content = await fetch(session, url, timeout=30)
+            soup = BeautifulSoup(content, "lxml")
+            await process_table(
+                session,
+                soup,
+                ".custom__table-wrapper",  # General selector, logic inside finds correct one
+                row_attribute,
+                source_table_name,
+                all_data,
+            )
+        except aiohttp.ClientError as e:
+            print(f"HTTP Error fetching page {url}: {e}")
+        except Exception as e:
+            print(f"General Error processing page {url}: {e}")
+
 
 # --- Main Scraping Logic ---
-all_scraped_data = []
-
-# 1. Scrape Table 1: Pre-packaged Job Solutions (12 pages approx)
-print("\n--- Scraping Table 1: Pre-packaged Job Solutions ---")
-# Determine the max number of pages dynamically or set a reasonable limit
-# Based on HTML: last page link is 12, so start goes up to 11*12 = 132
-max_start_table1 = 132
-page_urls_table1 = [catalog_url] + [
-    f"{catalog_url}?start={i}&type=1&type=2"
-    for i in range(12, max_start_table1 + 1, 12)
-]
-
-for i, url in enumerate(page_urls_table1):
-    print(f"\nScraping Page {i + 1}/{len(page_urls_table1)} for Table 1: {url}")
-    try:
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, "html.parser")
-        process_table(
-            soup,
-            ".custom__table-wrapper",  # General selector, logic inside finds correct one
+async def main():
+    all_scraped_data = []
+    connector = aiohttp.TCPConnector(limit=16)
+    async with aiohttp.ClientSession(headers=headers, connector=connector) as session:
+        # 1. Scrape Table 1: Pre-packaged Job Solutions (12 pages approx)
+        print("\n--- Scraping Table 1: Pre-packaged Job Solutions ---")
+        # Determine the max number of pages dynamically or set a reasonable limit
+        # Based on HTML: last page link is 12, so start goes up to 11*12 = 132
+        max_start_table1 = 132
+        page_urls_table1 = [catalog_url] + [
+            f"{catalog_url}?start={i}&type=1&type=2"
+            for i in range(12, max_start_table1 + 1, 12)
+        ]
+        await scrape_catalog_pages(
+            session,
+            page_urls_table1,
             "data-course-id",
             "Pre-packaged Job Solutions",
             all_scraped_data,
         )
-        # Add a small delay between catalog page requests
-        if i < len(page_urls_table1) - 1:
-            time.sleep(1)
-    except requests.exceptions.RequestException as e:
-        print(f"HTTP Error fetching page {url}: {e}")
-    except Exception as e:
-        print(f"General Error processing page {url}: {e}")
-
-
-# 2. Scrape Table 2: Individual Test Solutions (32 pages approx)
-print("\n--- Scraping Table 2: Individual Test Solutions ---")
-# Based on HTML: last page link is 32, so start goes up to 31*12 = 372
-max_start_table2 = 372
-page_urls_table2 = [catalog_url] + [  # Start from base URL again for page 1
-    f"{catalog_url}?start={i}&type=1&type=1"
-    for i in range(12, max_start_table2 + 1, 12)
-]
-
-for i, url in enumerate(page_urls_table2):
-    # Don't re-fetch page 1 if we already got it (assuming it always has both tables)
-    # Optimization: Skip fetching page 1 again if it's the same URL as table 1's page 1
-    if i == 0 and url == page_urls_table1[0]:
-        print(f"\nSkipping Page 1 fetch for Table 2 (already processed): {url}")
-        # We still need to process the *table* from the soup object fetched earlier
-        # Re-fetch page 1 only if needed, or use cached soup if implemented
-        # For simplicity here, we *will* re-fetch page 1, but process only the second table.
-        # A better approach might cache the soup of page 1.
-        # Let's re-fetch for simplicity and robustness against pages missing one table.
-        print(f"\nRe-fetching Page {i + 1}/{len(page_urls_table2)} for Table 2: {url}")
-        pass  # Fall through to fetching code below
-
-    print(f"\nScraping Page {i + 1}/{len(page_urls_table2)} for Table 2: {url}")
-    try:
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, "html.parser")
-        process_table(
-            soup,
-            ".custom__table-wrapper",  # General selector, logic inside finds correct one
+
+        # 2. Scrape Table 2: Individual Test Solutions (32 pages approx)
+        print("\n--- Scraping Table 2: Individual Test Solutions ---")
+        # Based on HTML: last page link is 32, so start goes up to 31*12 = 372
+        # Page 1 is re-fetched for robustness against pages missing one table
+        max_start_table2 = 372
+        page_urls_table2 = [catalog_url] + [  # Start from base URL again for page 1
+            f"{catalog_url}?start={i}&type=1&type=1"
+            for i in range(12, max_start_table2 + 1, 12)
+        ]
+        await scrape_catalog_pages(
+            session,
+            page_urls_table2,
             "data-entity-id",
             "Individual Test Solutions",
             all_scraped_data,
         )
-        # Add a small delay between catalog page requests
-        if i < len(page_urls_table2) - 1:
-            time.sleep(1)
-    except requests.exceptions.RequestException as e:
-        print(f"HTTP Error fetching page {url}: {e}")
-    except Exception as e:
-        print(f"General Error processing page {url}: {e}")
+
+    save_to_csv(all_scraped_data)
+
 
 # --- Export to CSV ---
-print(f"\nTotal records scraped: {len(all_scraped_data)}")
-if all_scraped_data:
+def save_to_csv(all_scraped_data):
+    print(f"\nTotal records scraped: {len(all_scraped_data)}")
+    if not all_scraped_data:
+        print("No data was scraped. CSV file not created.")
+        return
+
     df = pd.DataFrame(all_scraped_data)
 
     # Reorder columns for clarity
@@ -257,5 +284,7 @@ if all_scraped_data:
         print("Saved combined data to shl_catalog_detailed_combined.csv")
     except Exception as e:
         print(f"Error saving to CSV: {e}")
-else:
-    print("No data was scraped. CSV file not created.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,176 @@
+import json
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.retrievers import BM25Retriever
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from engine2 import (
+    AssessmentStreamParser,
+    LRUCache,
+    SemanticCache,
+    SHLRecommendationEngine,
+    _bm25_tokens,
+)
+
+
+def make_engine(texts, vectors):
+    """Engine with only the retrieval state set up, over the given documents"""
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    ids = [str(i) for i in range(len(texts))]
+    docstore = InMemoryDocstore(
+        {i: Document(page_content=text) for i, text in zip(ids, texts)}
+    )
+
+    engine = object.__new__(SHLRecommendationEngine)
+    engine.vectorstore = FAISS(None, index, docstore, dict(enumerate(ids)))
+    engine.use_mmr = False
+    engine.bm25_weight = 0.4
+    engine._retrieval_cache = LRUCache()
+    engine._bm25_doc_ids = ids
+    engine.bm25 = BM25Retriever.from_documents(
+        [docstore.search(i) for i in ids], preprocess_func=_bm25_tokens
+    )
+    return engine
+
+
+def catalogue():
+    # Twenty sales documents spread out from the query direction, plus one
+    # Java document pointing away from it, i.e. a keyword-only match
+    dimension = 8
+    query_vector = np.eye(dimension, dtype="float32")[0]
+    vectors = [query_vector + 0.05 * i * np.eye(dimension)[1] for i in range(20)]
+    vectors.append(-query_vector)
+    texts = [f"sales manager report {i}" for i in range(20)]
+    texts.append("java developer knowledge test")
+    return texts, np.asarray(vectors, dtype="float32"), query_vector
+
+
+def test_keyword_only_match_is_retrieved():
+    texts, vectors, query_vector = catalogue()
+    engine = make_engine(texts, vectors)
+
+    [context] = engine._retrieve_batch(["java"], [query_vector], 5)
+
+    contents = [doc.page_content for doc in context]
+    assert len(contents) == 5
+    assert "java developer knowledge test" in contents
+    assert contents[0] == "sales manager report 0"
+
+
+def test_no_keyword_match_keeps_dense_ranking():
+    texts, vectors, query_vector = catalogue()
+    engine = make_engine(texts, vectors)
+
+    [context] = engine._retrieve_batch(["python"], [query_vector], 5)
+
+    assert [doc.page_content for doc in context] == [
+        f"sales manager report {i}" for i in range(5)
+    ]
+
+
+def page_content(slug, description, duration):
+    """Document text in the shape prep.py builds it"""
+    return (
+        f"Title: {slug.replace('-', ' ').title()}\n"
+        "Test Type: ['Knowledge & Skills']\n"
+        f"Description: {description}\n"
+        f"Assessment Length: {duration} minutes\n"
+        "Remote Testing Support: Yes\n"
+        "Adaptive Support: No\n"
+        f"URL: https://www.shl.com/solutions/products/product-catalog/view/{slug}/"
+    )
+
+
+def test_keyword_search_on_real_documents():
+    texts, vectors, query_vector = catalogue()
+    texts = [
+        page_content(f"sales-manager-{i}", "Measures sales skills for managers.", 30)
+        for i in range(20)
+    ]
+    texts.append(page_content("java-8-new", "Multi-choice test of Java 8.", 18))
+    engine = make_engine(texts, vectors)
+
+    [context] = engine._retrieve_batch(
+        ["Hiring JAVA developers, fast."], [query_vector], 5
+    )
+
+    assert texts[-1] in [doc.page_content for doc in context]
+    # Words every document shares through its template are not keyword matches
+    assert (
+        engine._keyword_search("Looking for an assessment with remote testing.", 21)
+        == []
+    )
+
+
+ASSESSMENT = {
+    "url": "https://www.shl.com/java-8-new/",
+    "adaptive_support": "No",
+    "description": "Java 8",
+    "duration": 18,
+    "remote_support": "Yes",
+    "test_type": ["Knowledge & Skills"],
+}
+
+
+def parse(raw, max_results=10):
+    engine = object.__new__(SHLRecommendationEngine)
+    return engine._parse_response(raw, max_results)["recommended_assessments"]
+
+
+def test_parse_keeps_valid_items_next_to_malformed_ones():
+    coerced = {**ASSESSMENT, "duration": "30", "test_type": "Simulations"}
+    missing = {k: v for k, v in ASSESSMENT.items() if k != "url"}
+    raw = json.dumps({"recommended_assessments": [ASSESSMENT, coerced, missing]})
+
+    assert parse(raw) == [
+        ASSESSMENT,
+        {**ASSESSMENT, "duration": 30, "test_type": ["Simulations"]},
+    ]
+
+
+def test_parse_recovers_items_before_truncation():
+    raw = json.dumps({"recommended_assessments": [ASSESSMENT, ASSESSMENT]})
+
+    assert parse(raw[:-40]) == [ASSESSMENT]
+    assert parse("not json") == []
+
+
+def test_semantic_cache_misses_when_entry_holds_fewer_results():
+    cache = SemanticCache(4)
+    vector = [1.0, 0.0, 0.0, 0.0]
+    cache.add(vector, {"recommended_assessments": [ASSESSMENT] * 3}, 3)
+
+    assert cache.lookup(vector, 10) is None
+    assert len(cache.lookup(vector, 2)["recommended_assessments"]) == 3
+
+    cache.add(vector, {"recommended_assessments": [ASSESSMENT] * 10}, 10)
+    assert len(cache.lookup(vector, 10)["recommended_assessments"]) == 10
+
+
+def stream(raw, size=7):
+    parser = AssessmentStreamParser()
+    chunks = [raw[i : i + size] for i in range(0, len(raw), size)]
+    return list(parser.parse(chunks)), parser.complete
+
+
+def test_stream_parser_yields_strict_json():
+    raw = json.dumps({"recommended_assessments": [ASSESSMENT, ASSESSMENT]})
+
+    assert stream(raw) == ([ASSESSMENT, ASSESSMENT], True)
+
+
+def test_stream_parser_repairs_fenced_output():
+    raw = json.dumps({"recommended_assessments": [ASSESSMENT, ASSESSMENT]})
+
+    assert stream(f"```json\n{raw}\n```") == ([ASSESSMENT, ASSESSMENT], False)
+    assert stream(f"{raw}\nHope this helps!") == ([ASSESSMENT, ASSESSMENT], False)
+
+
+def test_stream_parser_recovers_items_before_truncation():
+    raw = json.dumps({"recommended_assessments": [ASSESSMENT, ASSESSMENT]})
+
+    assert stream(raw[:-40]) == ([ASSESSMENT], False)